@@ -1,10 +1,14 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import plotly.express as px
+import plotly.graph_objects as go
 import numpy as np
 import geopandas as gpd
-import importlib
+import pyarrow as pa
+import json
+import os
+import tempfile
+import types
 
 # Configurações da página
 st.set_page_config(layout="wide", page_title="Comparador Global de Emissões de CO₂")
@@ -14,51 +18,6 @@ st.title("Comparador Global de Emissões de CO₂ 📊")
 st.subheader('Dados de Our World in Data')
 st.link_button("Link da fonte (em inglês)", "https://ourworldindata.org/co2-and-greenhouse-gas-emissions?utm_source=pocket_shared")
 
-# Verificação de pacotes necessários
-required_packages = ["pandas", "matplotlib", "plotly", "geopandas", "numpy"]
-missing_packages = []
-
-for package in required_packages:
-    try:
-        importlib.import_module(package)
-    except ImportError:
-        missing_packages.append(package)
-
-if missing_packages:
-    st.warning(f"Atenção: as seguintes bibliotecas estão faltando: {', '.join(missing_packages)}")
-    st.markdown("""
-    Para instalar as bibliotecas necessárias, execute:
-    ```
-    pip install pandas matplotlib plotly geopandas numpy
-    ```
-    """)
-
-# Funções para carregar dados
-@st.cache_data
-def carregar_dados():
-    return pd.read_csv('owid-co2-data.csv')
-
-@st.cache_data
-def carregar_geojson():
-    url = "https://raw.githubusercontent.com/nvkelso/natural-earth-vector/master/geojson/ne_110m_admin_0_countries.geojson"
-    try:
-        return gpd.read_file(url)
-    except Exception as e:
-        st.error(f"Erro ao carregar dados geográficos: {e}")
-        return gpd.GeoDataFrame(columns=['geometry', 'name'])
-
-# Carregando os dados
-df = carregar_dados()
-world = carregar_geojson()
-
-# Padronização dos nomes dos países
-if 'NAME' in world.columns:
-    world = world.rename(columns={'NAME': 'country'})
-elif 'ADMIN' in world.columns:
-    world = world.rename(columns={'ADMIN': 'country'})
-elif 'name' in world.columns:
-    world = world.rename(columns={'name': 'country'})
-
 # Mapeamento de nomes alternativos
 country_mapping = {
     'United States': 'United States of America',
@@ -77,109 +36,295 @@ country_mapping = {
     'Bosnia and Herzegovina': 'Bosnia and Herz.'
 }
 
-df['country_mapped'] = df['country'].map(lambda x: country_mapping.get(x, x))
+# Cores dos avisos de variação, na sintaxe de cores do markdown do Streamlit (acompanham o tema claro/escuro)
+CORES_VARIACAO = {
+    'aumento': 'green',
+    'reducao': 'orange',
+    'igual': 'blue',
+}
+
+# Arquivos de dados
+ARQUIVO_CSV = 'owid-co2-data.csv'
+ARQUIVO_PARQUET = 'owid-co2-data.parquet'
+COLUNAS_USADAS = ['country', 'year', 'co2']
+ARQUIVO_GEOJSON = 'ne_110m_admin_0_countries.geojson'
+ARQUIVO_GEOPARQUET = 'ne_110m_countries.parquet'
+
+# Funções para carregar dados
+def gravar_parquet(tabela, caminho, **opcoes):
+    # Grava num arquivo temporário do mesmo diretório e só então o troca pelo definitivo:
+    # uma escrita interrompida nunca deixa um cache truncado (e mais novo que a origem) no lugar
+    fd, temporario = tempfile.mkstemp(prefix=os.path.basename(caminho) + '.', suffix='.tmp',
+                                      dir=os.path.dirname(os.path.abspath(caminho)))
+    os.close(fd)
+    try:
+        tabela.to_parquet(temporario, **opcoes)
+        os.replace(temporario, caminho)
+    except BaseException:
+        os.remove(temporario)
+        raise
+
+def atualizar_parquet(forcar=False):
+    # Regera o Parquet apenas quando o CSV for mais recente que ele (ou quando o cache estiver ilegível)
+    if forcar or not os.path.exists(ARQUIVO_PARQUET) or os.path.getmtime(ARQUIVO_CSV) > os.path.getmtime(ARQUIVO_PARQUET):
+        gravar_parquet(pd.read_csv(ARQUIVO_CSV, engine='pyarrow'), ARQUIVO_PARQUET, engine='pyarrow', compression='snappy')
+
+# cache_resource devolve sempre o mesmo objeto, sem serializar os DataFrames a cada rerun;
+# por isso o resultado é tratado como somente leitura
+@st.cache_resource
+def carregar_dados():
+    try:
+        atualizar_parquet()
+        try:
+            df = pd.read_parquet(ARQUIVO_PARQUET, columns=COLUNAS_USADAS, engine='pyarrow')
+        except (ValueError, pa.ArrowException):
+            # Cache corrompido: reconstrói a partir do CSV e lê de novo
+            atualizar_parquet(forcar=True)
+            df = pd.read_parquet(ARQUIVO_PARQUET, columns=COLUNAS_USADAS, engine='pyarrow')
+    except (OSError, ValueError, pa.ArrowException):
+        # Sem permissão de escrita no diretório (ou cache irrecuperável): lê direto do CSV
+        df = pd.read_csv(ARQUIVO_CSV, engine='pyarrow', usecols=COLUNAS_USADAS, dtype={'year': 'int32'})
+    df['country'] = df['country'].astype('category')
+    df['year'] = df['year'].astype('int32')
+    # Converte cada nome único uma só vez e propaga o resultado para todas as linhas;
+    # as categorias já são os nomes únicos, sem precisar varrer a coluna
+    paises = df['country'].cat.categories
+    nomes_mapeados = dict(zip(paises, (country_mapping.get(p, p) for p in paises)))
+    df['country_mapped'] = df['country'].map(nomes_mapeados).astype('category')
+    # Fatias por ano pré-calculadas: cada filtro vira uma consulta ao dicionário
+    por_ano = {int(ano): grupo.reset_index(drop=True) for ano, grupo in df.groupby('year', sort=False)}
+    # Códigos (categóricos) dos países com valor de co2 em cada ano, para interseções vetorizadas;
+    # linhas sem co2 (Mônaco, San Marino etc.) ficam de fora e não chegam ao seletor de países
+    presenca = {ano: np.unique(grupo.loc[grupo['co2'].notna(), 'country'].cat.codes.to_numpy()) for ano, grupo in por_ano.items()}
+    # Anos oferecidos nos seletores (a partir de 1990)
+    anos_validos = sorted(ano for ano in por_ano if ano >= 1990)
+    return types.SimpleNamespace(df=df, por_ano=por_ano, presenca=presenca, anos_validos=anos_validos)
+
+@st.cache_data
+def recorte_anos(ano1, ano2):
+    # Tudo o que depende só do par de anos fica em cache; trocar os países não recalcula nada disso
+    dados = carregar_dados()
+    # Indexados por país, para que os países escolhidos sejam lidos num único .loc em vez de um filtro booleano
+    df_ano1 = dados.por_ano[ano1].set_index('country')
+    df_ano2 = dados.por_ano[ano2].set_index('country')
+    return df_ano1, df_ano2, df_ano1['co2'].mean(), df_ano2['co2'].mean()
+
+@st.cache_data
+def paises_em_comum(ano1, ano2):
+    # Países com dados nos dois anos, para o seletor da aba de comparação
+    dados = carregar_dados()
+    # As categorias já vêm ordenadas, então a interseção dos códigos sai em ordem alfabética
+    codigos = np.intersect1d(dados.presenca[ano1], dados.presenca[ano2], assume_unique=True)
+    return dados.df['country'].cat.categories[codigos].tolist()
+
+@st.cache_data
+def comparacao_paises(paises, ano1, ano2):
+    # Uma linha por país com os valores dos dois anos; diferenças e razões calculadas de uma vez
+    df_ano1, df_ano2, media1, media2 = recorte_anos(ano1, ano2)
+    paises = list(paises)
+    comparacao = pd.DataFrame({'v1': df_ano1.loc[paises, 'co2'], 'v2': df_ano2.loc[paises, 'co2']})
+    comparacao['dif'] = comparacao['v2'] - comparacao['v1']
+    comparacao['r1'] = comparacao['v1'] / media1
+    comparacao['r2'] = comparacao['v2'] / media2
+    return comparacao
+
+@st.cache_data
+def grafico_comparacao(paises, ano1, ano2):
+    # A figura só é refeita quando muda a seleção de países ou algum dos anos
+    _, _, media1, media2 = recorte_anos(ano1, ano2)
+    comparacao = comparacao_paises(paises, ano1, ano2)
+    paises = list(paises)
+    # Plotly, como no mapa: o gráfico é desenhado no navegador, sem gerar PNG no servidor
+    fig = go.Figure()
+    fig.add_bar(x=paises, y=comparacao['v1'].to_numpy(), name=f"{ano1}")
+    fig.add_bar(x=paises, y=comparacao['v2'].to_numpy(), name=f"{ano2}")
+    for ano, media, cor in ((ano1, media1, 'blue'), (ano2, media2, 'green')):
+        fig.add_hline(y=media, line_dash='dash', line_color=cor)
+        # As médias entram na legenda: anotações nas duas linhas se sobrepunham quando os valores eram próximos
+        fig.add_scatter(x=[None], y=[None], mode='lines', line=dict(dash='dash', color=cor),
+                        name=f'Média Global {ano} ({round(media, 1)} Mt)')
+    fig.update_layout(barmode='group', yaxis_title="Emissões de CO₂ (milhões de toneladas)", xaxis_tickangle=-45)
+    return fig
+
+def ler_geojson():
+    # Usa o GeoJSON do Natural Earth distribuído com o repositório (já em EPSG:4326), sem acesso à rede
+    try:
+        world = gpd.read_file(ARQUIVO_GEOJSON, columns=['NAME'], engine='pyogrio')
+    except Exception:
+        # Sem st.error aqui: a função roda dentro de caches chamados por vários outros, que repetiriam
+        # a mensagem; aba_mapas avisa uma única vez quando o mapa vem vazio
+        world = gpd.GeoDataFrame(columns=['geometry', 'name'])
+
+    # Padronização dos nomes dos países
+    if 'NAME' in world.columns:
+        world = world.rename(columns={'NAME': 'country'})
+    elif 'ADMIN' in world.columns:
+        world = world.rename(columns={'ADMIN': 'country'})
+    elif 'name' in world.columns:
+        world = world.rename(columns={'name': 'country'})
+
+    # Reprojeta uma única vez aqui, fora do caminho de renderização do mapa
+    if world.crs is not None and world.crs != "EPSG:4326":
+        world = world.to_crs("EPSG:4326")
+
+    if not world.empty:
+        try:
+            gravar_parquet(world, ARQUIVO_GEOPARQUET)
+        except OSError:
+            pass  # diretório somente leitura: o GeoJSON continua sendo lido a cada início
+    return world
+
+# cache_resource: o GeoDataFrame (com objetos shapely) é compartilhado sem ser serializado a cada rerun
+@st.cache_resource
+def carregar_geojson():
+    # Depois da primeira leitura, o mapa já padronizado e em EPSG:4326 vem do GeoParquet
+    # Cache ausente, desatualizado ou ilegível (ou GeoJSON ausente): volta para ler_geojson(),
+    # que devolve um mapa vazio se o GeoJSON também falhar
+    try:
+        cache_valido = os.path.getmtime(ARQUIVO_GEOPARQUET) >= os.path.getmtime(ARQUIVO_GEOJSON)
+        world = gpd.read_parquet(ARQUIVO_GEOPARQUET) if cache_valido else None
+    except (OSError, ValueError, pa.ArrowException):
+        world = None
+    if world is None:
+        world = ler_geojson()
+    return world
+
+@st.cache_resource
+def co2_por_pais_mapa():
+    # Tabela país × ano já na ordem dos países do GeoJSON: cada mapa só lê uma coluna, sem junção
+    tabela = carregar_dados().df.pivot_table(
+        index='country_mapped', columns='year', values='co2', aggfunc='first', observed=True, dropna=False
+    )
+    return tabela.reindex(carregar_geojson()['country'])
+
+def dados_mapa(ano_mapa):
+    # A geometria fica de fora e chega ao Plotly só pelo GeoJSON em cache
+    tabela = co2_por_pais_mapa()
+    return pd.DataFrame({'country': tabela.index, 'co2': tabela[ano_mapa].to_numpy()})
 
-# Tabs principais
-tab1, tab2, tab_debug = st.tabs(["Comparação por País", "Mapas Interativos", "Depuração"])
+@st.cache_resource
+def geojson_mundo():
+    # As geometrias são serializadas para GeoJSON uma única vez e compartilhadas por todos os mapas;
+    # a simplificação (0,1°, imperceptível na escala global) reduz os vértices enviados ao navegador
+    mundo = carregar_geojson()[['country', 'geometry']].copy()
+    mundo['geometry'] = mundo.geometry.simplify(tolerance=0.1, preserve_topology=True)
+    return json.loads(mundo.to_json(drop_id=True))
+
+# cache_resource: a figura de cada ano é montada uma vez e reaproveitada sem cópia nos reruns
+@st.cache_resource
+def mapa_co2(ano_mapa):
+    map_data = dados_mapa(ano_mapa)
+
+    fig = px.choropleth(
+        map_data,
+        geojson=geojson_mundo(),
+        locations='country',
+        featureidkey='properties.country',
+        color='co2',
+        color_continuous_scale="Reds",
+        hover_name='country',
+        hover_data=['co2'],
+        title=f'Emissões de CO₂ por País ({ano_mapa})',
+        labels={'co2': 'Emissões de CO₂ (Mt)'}
+    )
+    fig.update_geos(visible=False, showcoastlines=True, showcountries=True, showland=True, landcolor="lightgray")
+    fig.update_layout(margin={"r":0,"t":50,"l":0,"b":0})
+    return fig
+
+@st.cache_data
+def depuracao_eua():
+    # Calculado uma vez: a aba de depuração não refaz as buscas a cada rerun
+    df = carregar_dados().df
+    world = carregar_geojson()
+    # Busca nos nomes únicos (categorias), sem regex e sem percorrer todas as linhas
+    nomes_eua = [pais for pais in df['country'].cat.categories if 'United States' in pais]
+    amostra = df[df['country'].isin(nomes_eua)][['country', 'year', 'co2']].head()
+    usa_in_geojson = any('United States' in pais for pais in world['country'])
+    possible_usa = [pais for pais in world['country'] if any(termo in pais for termo in ('States', 'America', 'USA', 'United'))]
+    return bool(nomes_eua), amostra, usa_in_geojson, possible_usa
+
+# Carregando os dados
+dados = carregar_dados()
+
+# Tabs principais (a de depuração só é criada, e executada, quando pedida na barra lateral)
+mostrar_depuracao = st.sidebar.checkbox("Mostrar aba de depuração")
+if mostrar_depuracao:
+    tab1, tab2, tab_debug = st.tabs(["Comparação por País", "Mapas Interativos", "Depuração"])
+else:
+    tab1, tab2 = st.tabs(["Comparação por País", "Mapas Interativos"])
 
 # Lista de anos disponíveis
-anos_disponiveis = sorted(df['year'].dropna().unique())
-anos_validos = [ano for ano in anos_disponiveis if ano >= 1990]
+anos_validos = dados.anos_validos
 
-with tab1:
+# Cada aba é um fragmento: mexer num widget reexecuta só a própria aba, não o script inteiro
+@st.fragment
+def aba_comparacao():
     col1, col2 = st.columns(2)
     with col1:
         ano1 = st.selectbox("Escolha o 1º ano:", anos_validos, index=len(anos_validos)-5, key="ano1_tab1")
     with col2:
         ano2 = st.selectbox("Escolha o 2º ano para comparar:", anos_validos, index=len(anos_validos)-1, key="ano2_tab1")
 
-    df_ano1 = df[df['year'] == ano1]
-    df_ano2 = df[df['year'] == ano2]
-    paises_comuns = sorted(set(df_ano1['country']).intersection(set(df_ano2['country'])))
+    paises_comuns = paises_em_comum(ano1, ano2)
     paises_selecionados = st.multiselect("Escolha um ou mais países:", paises_comuns)
 
     if not paises_selecionados:
         st.info("Selecione pelo menos um país para comparar.")
     else:
-        df1 = df_ano1[df_ano1['country'].isin(paises_selecionados)]
-        df2 = df_ano2[df_ano2['country'].isin(paises_selecionados)]
-        media1 = df_ano1['co2'].mean()
-        media2 = df_ano2['co2'].mean()
+        comparacao = comparacao_paises(tuple(paises_selecionados), ano1, ano2)
 
         st.subheader("📈 Comparação de Emissões entre os anos selecionados")
-        fig, ax = plt.subplots()
-        ax.bar(df1['country'], df1['co2'], width=0.4, label=f"{ano1}", align='edge')
-        ax.bar(df2['country'], df2['co2'], width=-0.4, label=f"{ano2}", align='edge')
-        ax.axhline(media1, color='blue', linestyle='--', label=f'Média Global {ano1} ({round(media1, 1)} Mt)')
-        ax.axhline(media2, color='green', linestyle='--', label=f'Média Global {ano2} ({round(media2, 1)} Mt)')
-        ax.set_ylabel("Emissões de CO₂ (milhões de toneladas)")
-        ax.set_xticks(range(len(paises_selecionados)))
-        ax.set_xticklabels(paises_selecionados, rotation=45, ha='right')
-        ax.legend()
-        st.pyplot(fig)
+        st.plotly_chart(grafico_comparacao(tuple(paises_selecionados), ano1, ano2), use_container_width=True, key="grafico_comparacao")
 
         st.markdown("### 📌 Análise por país")
-        for pais in paises_selecionados:
-            v1 = df1[df1['country'] == pais]['co2'].values[0]
-            v2 = df2[df2['country'] == pais]['co2'].values[0]
-            st.write(f"**{pais}**:")
-            st.write(f"- Em {ano1}: {round(v1)} Mt ({round(v1/media1, 2)}x a média)")
-            st.write(f"- Em {ano2}: {round(v2)} Mt ({round(v2/media2, 2)}x a média)")
-            dif = v2 - v1
+        # Todos os cartões vão num único st.markdown, em vez de vários elementos por país
+        cartoes = []
+        for pais, v1, v2, dif, r1, r2 in comparacao.itertuples():
             if dif > 0:
-                st.success(f"Aumento de {round(dif)} Mt entre {ano1} e {ano2}")
+                tipo, texto = 'aumento', f"Aumento de {round(dif)} Mt entre {ano1} e {ano2}"
             elif dif < 0:
-                st.warning(f"Redução de {round(abs(dif))} Mt entre {ano1} e {ano2}")
+                tipo, texto = 'reducao', f"Redução de {round(abs(dif))} Mt entre {ano1} e {ano2}"
             else:
-                st.info("Sem variação entre os anos")
+                tipo, texto = 'igual', "Sem variação entre os anos"
+            cartoes.append(
+                f"**{pais}**:\n\n"
+                f"- Em {ano1}: {round(v1)} Mt ({round(r1, 2)}x a média)\n"
+                f"- Em {ano2}: {round(v2)} Mt ({round(r2, 2)}x a média)\n\n"
+                f":{CORES_VARIACAO[tipo]}-background[{texto}]"
+            )
+        st.markdown('\n\n'.join(cartoes))
 
-with tab2:
+@st.fragment
+def aba_mapas():
     st.header("🗺️ Mapas Interativos de Emissões de CO₂")
     ano_mapa = st.selectbox("Escolha o ano para visualizar:", anos_validos, index=len(anos_validos)-1, key="ano_mapa")
-    df_ano_mapa = df[df['year'] == ano_mapa]
-    map_data = world.copy()
 
-    if 'country_mapped' in df_ano_mapa.columns:
-        map_data = map_data.merge(df_ano_mapa[['country_mapped', 'co2']], left_on='country', right_on='country_mapped', how='left')
-    else:
-        map_data = map_data.merge(df_ano_mapa[['country', 'co2']], on='country', how='left')
-
-    map_data['co2_categoria'] = pd.cut(
-        map_data['co2'],
-        bins=[0, 50, 200, 1000, 5000, float('inf')],
-        labels=['Muito Baixo', 'Baixo', 'Médio', 'Alto', 'Muito Alto']
-    )
-
-    map_data = map_data.to_crs("EPSG:4326")
+    if carregar_geojson().empty:
+        st.error(f"Erro ao carregar dados geográficos: não foi possível ler {ARQUIVO_GEOJSON}")
+        return
 
     try:
-        fig = px.choropleth(
-            map_data,
-            geojson=map_data.geometry,
-            locations=map_data.index,
-            color='co2',
-            color_continuous_scale="Reds",
-            hover_name='country',
-            hover_data=['co2'],
-            title=f'Emissões de CO₂ por País ({ano_mapa})',
-            labels={'co2': 'Emissões de CO₂ (Mt)'}
-        )
-        fig.update_geos(visible=False, showcoastlines=True, showcountries=True, showland=True, landcolor="lightgray")
-        fig.update_layout(margin={"r":0,"t":50,"l":0,"b":0})
-        st.plotly_chart(fig, use_container_width=True)
+        fig = mapa_co2(ano_mapa)
+        # Chave fixa: o Streamlit reconhece o mesmo elemento entre reruns e não devolve estado de seleção
+        st.plotly_chart(fig, use_container_width=True, key="mapa_co2")
     except Exception as e:
         st.error(f"Erro ao gerar o mapa: {e}")
 
-with tab_debug:
-    st.subheader("🔍 Depuração dos dados dos EUA")
-    usa_in_df = any(df['country'].str.contains('United States', na=False))
-    st.write(f"EUA nos dados CSV: {usa_in_df}")
-    if usa_in_df:
-        st.write(df[df['country'].str.contains('United States', na=False)][['country', 'year', 'co2']].head())
-
-    usa_in_geojson = any(world['country'].str.contains('United States', na=False))
-    st.write(f"EUA no GeoJSON: {usa_in_geojson}")
-    if not usa_in_geojson:
-        possible_usa = world[world['country'].str.contains('States|America|USA|United', na=False)]['country'].unique()
-        st.write("Possíveis nomes alternativos encontrados:")
-        st.write(possible_usa)
+with tab1:
+    aba_comparacao()
+
+with tab2:
+    aba_mapas()
+
+if mostrar_depuracao:
+    with tab_debug:
+        st.subheader("🔍 Depuração dos dados dos EUA")
+        usa_in_df, amostra_usa, usa_in_geojson, possible_usa = depuracao_eua()
+        st.write(f"EUA nos dados CSV: {usa_in_df}")
+        if usa_in_df:
+            st.write(amostra_usa)
+
+        st.write(f"EUA no GeoJSON: {usa_in_geojson}")
+        if not usa_in_geojson:
+            st.write("Possíveis nomes alternativos encontrados:")
+            st.write(possible_usa)